@@ -1,13 +1,20 @@
+import contextlib
 import datetime
+import functools
+import struct
+import threading
 import time
 import queue
 import logging
+import random
 
 from .momonga_exception import (MomongaResponseNotExpected,
                                 MomongaResponseNotPossible,
-                                MomongaNeedToReopen)
+                                MomongaNeedToReopen,
+                                MomongaKeyError)
 from .momonga_response import SkEventRxUdp
 from .momonga_session_manager import MomongaSessionManager
+from .momonga_session_manager import drain_queue
 from .momonga_session_manager import logger as session_manager_logger
 from .momonga_sk_wrapper import logger as sk_wrapper_logger
 
@@ -20,6 +27,118 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+_REXMIT = object()  # returned by a response handler to retransmit the request.
+
+_EHD = b'\x10\x81'  # echonet lite edata format 1
+_CONTROLLER_EOJ = b'\x05\xFF\x01'  # controller class
+_SMART_METER_EOJ = b'\x02\x88\x01'  # low-voltage smart electric energy meter class
+_REQUEST_SEOJ_DEOJ = _CONTROLLER_EOJ + _SMART_METER_EOJ  # the seoj and deoj of a request
+_RESPONSE_SEOJ_DEOJ = _SMART_METER_EOJ + _CONTROLLER_EOJ  # the seoj and deoj of a response
+_REQUEST_HEADER = struct.Struct('>2sH6s1s')  # ehd, tid, seoj and deoj, esv
+_RESPONSE_HEADER = struct.Struct('>2s2s6s')  # ehd, tid, seoj and deoj
+_ESV_SETC = b'\x61'
+_ESV_GET = b'\x62'
+_ESV_SETGET = b'\x6E'
+
+# the units for cumulative energy indexed by the value of 0xE1.
+_UNIT_TABLE = (1,       # 0x00
+               0.1,     # 0x01
+               0.01,    # 0x02
+               0.001,   # 0x03
+               0.0001,  # 0x04
+               None, None, None, None, None,  # 0x05-0x09 are reserved.
+               10,      # 0x0A
+               100,     # 0x0B
+               1000,    # 0x0C
+               10000)   # 0x0D
+
+_HALF_HOUR = datetime.timedelta(minutes=30)  # the interval of the historical data points.
+_MIDNIGHT = datetime.time(0, 0)
+_UINT32 = struct.Struct('>I')  # the layout of 0xD3, 0xE0 and 0xE3
+_INT32 = struct.Struct('>i')  # the layout of 0xE7
+_INSTANTANEOUS_CURRENT = struct.Struct('>hh')  # the layout of 0xE8
+_FIXED_TIME_ENERGY = struct.Struct('>HBBBBBI')  # the layout of 0xEA and 0xEB
+_HISTORICAL_ENERGY_1 = struct.Struct('>H48I')  # the layout of 0xE2 and 0xE4
+_TIME_FOR_HISTORICAL_DATA_2 = struct.Struct('>HBBBBB')  # the layout of 0xED and the head of 0xEC
+_NO_DATA = b'\xFF\xFF\xFF\xFE'  # a historical data point that has not been collected
+
+# the properties whose values do not change during a session and how long they are cached in seconds.
+_CACHE_TTL = {0xD3: 86400,  # coefficient for cumulative energy
+              0xD7: 86400,  # number of effective digits for cumulative energy
+              0xE1: 86400}  # unit for cumulative energy
+
+# the properties whose values are scaled by the coefficient and the unit for cumulative energy.
+_CUMULATIVE_ENERGY_EPCS = frozenset((0xE0, 0xE2, 0xE3, 0xE4, 0xEA, 0xEB, 0xEC))
+
+
+def _format_epcs(epc_groups: list[list[int]]) -> str:
+    return ', '.join('%X' % epc for epcs in epc_groups for epc in epcs)
+
+
+def _scale_energy_data_points(energy_data_points: tuple[int],
+                              scale: int | float,
+                              maybe_missing: bool,
+                             ) -> list[int | float | None]:
+    # the sentinel scan over the raw bytes lets the common case skip the comparison per point.
+    if not maybe_missing:
+        return [energy * scale for energy in energy_data_points]
+    return [None if energy == 0xFFFFFFFE else energy * scale for energy in energy_data_points]
+
+
+@functools.lru_cache(maxsize=256)
+def _get_request_tail(epc: int) -> bytes:
+    # the part of a get request for a single property that follows the tid.
+    return _REQUEST_SEOJ_DEOJ + _ESV_GET + bytes((1, epc, 0))  # opc, epc and pdc
+
+
+@functools.lru_cache(maxsize=12)
+def _historical_energy_2_struct(num_of_data_points: int) -> struct.Struct:
+    # the normal and reverse direction energy pairs following the head of 0xEC.
+    return struct.Struct('>%dI' % (num_of_data_points * 2))
+
+
+@functools.lru_cache(maxsize=32)
+def _build_get_properties(epcs: frozenset[int]) -> tuple[tuple[int, bytes], ...]:
+    # polling loops tend to ask for the same set of properties every time.
+    return tuple((epc, b'') for epc in sorted(epcs))
+
+
+_NOT_CACHED = object()  # a sentinel, since a cached value may be anything.
+
+
+def _lookup_cached_response(response_cache: dict[int, tuple[object, float]],
+                            epc: int,
+                           ) -> object:
+    # the value cached for the epc, or _NOT_CACHED if it is absent or expired.
+    cached = response_cache.get(epc)
+    if cached is None or time.monotonic() >= cached[1]:
+        return _NOT_CACHED
+    return cached[0]
+
+
+def _store_cached_response(response_cache: dict[int, tuple[object, float]],
+                           epc: int,
+                           value: object,
+                          ) -> None:
+    # only the properties in _CACHE_TTL are kept.
+    ttl = _CACHE_TTL.get(epc)
+    if ttl is not None:
+        response_cache[epc] = (value, time.monotonic() + ttl)
+
+
+def _ttl_cache(epc: int):
+    # to keep the values that never change during a session without asking the meter again.
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self):
+            value = _lookup_cached_response(self.response_cache, epc)
+            if value is _NOT_CACHED:
+                value = func(self)
+                _store_cached_response(self.response_cache, epc, value)
+            return value
+        return wrapper
+    return decorator
+
 
 class Momonga:
     def __init__(self,
@@ -32,9 +151,23 @@ class Momonga:
         self.xmit_retry = 12
         self.recv_timeout = 12
         self.internal_xmit_interval = 5
+        self.xmit_backoff_base = 0.25  # the first wait before retransmitting, doubled on each retransmission.
+        self.max_xmit_backoff = 6  # slightly above internal_xmit_interval.
+        self.setget_supported = None  # probed on the first request for historical data 2.
         self.transaction_id = 0
         self.energy_coefficient = None
         self.energy_unit = None
+        self.energy_scale = None
+        self.response_cache = {}  # the values of the properties in _CACHE_TTL keyed by epc, cleared on close.
+        self.__smart_meter_addr = None
+        self.__set_buffer = None  # the properties to set on exiting batch().
+
+        # serializes the requests from multiple threads since they share recv_q.
+        self.request_lock = threading.RLock()
+
+        # the received lines are dispatched by their leading token.
+        self.__response_handlers = {'EVENT': self.__handle_event,
+                                    'ERXUDP': self.__handle_erxudp}
 
         # the following value will be set a pyserial object.
         self.session_manager = MomongaSessionManager(rbid, pwd, dev, baudrate, reset_dev)
@@ -50,6 +183,7 @@ class Momonga:
     def open(self):
         logger.info('Opening Momonga.')
         self.session_manager.open()
+        self.__smart_meter_addr = self.session_manager.smart_meter_addr  # resolved once a session is open.
         time.sleep(self.internal_xmit_interval)
         logger.info('Momonga is open.')
         return self
@@ -58,136 +192,215 @@ class Momonga:
         logger.info('Closing Momonga.')
         self.energy_coefficient = None
         self.energy_unit = None
+        self.energy_scale = None
+        self.response_cache.clear()
+        self.setget_supported = None  # the next session may be with another meter.
+        self.__smart_meter_addr = None
         self.session_manager.close()
         logger.info('Momonga is closed.')
 
     def __build_request_payload(self,
                                 tid: int,
-                                epc: int,
-                                edt: bytes = b'',
+                                esv: bytes,
+                                property_groups: list[list[tuple[int, bytes]]],
                                ) -> bytes:
-        ehd = b'\x10\x81'  # echonet lite edata format 1
-        tid = tid.to_bytes(4, 'big')[-2:]
-        seoj = b'\x05\xFF\x01'  # controller class
-        deoj = b'\x02\x88\x01'  # low-voltage smart electric energy meter class
-        opc = b'\x01'
-        if edt:
-            esv = b'\x61'  # setc
-        else:
-            esv = b'\x62'  # get
-        epc = epc.to_bytes(1, 'big')
-        pdc = len(edt).to_bytes(1, 'big')
-
-        return ehd + tid + seoj + deoj + esv + opc + epc + pdc + edt
+        if esv == _ESV_GET and len(property_groups[0]) == 1:
+            # most of the requests get a single property, and such frames only differ in the tid and epc.
+            return _EHD + tid.to_bytes(2, 'big') + _get_request_tail(property_groups[0][0][0])
+
+        payload = [_REQUEST_HEADER.pack(_EHD, tid, _REQUEST_SEOJ_DEOJ, esv)]
+        # setget carries the properties to set and the ones to get in this order, each led by its opc.
+        for properties in property_groups:
+            payload.append(bytes((len(properties),)))  # opc
+            for epc, edt in properties:
+                payload.append(bytes((epc, len(edt))))  # epc and pdc
+                payload.append(edt)
+        return b''.join(payload)
+
+    def __is_expected_response(self,
+                               data: bytes,
+                               tid: bytes,
+                              ) -> bool:
+        # to skip the frames for other transactions or nodes without raising an exception.
+        if len(data) < 12:
+            return False
+
+        ehd, rx_tid, seoj_deoj = _RESPONSE_HEADER.unpack_from(data)
+        # the responses for other transactions are the most likely ones to be rejected.
+        if rx_tid != tid:
+            return False
+
+        if ehd != _EHD:
+            return False
+
+        if seoj_deoj != _RESPONSE_SEOJ_DEOJ:
+            return False
+
+        return True
 
     def __extract_response_payload(self,
                                    data: bytes,
-                                   tid: int,
-                                   epc: int,
-                                  ) -> dict[str: bytes, str: int,
-                                            str: bytes, str: bytes,
-                                            str: int, str: int, str: int,
-                                            str: int, str: bytes | None]:
-        ehd = data[0:2]
-        if ehd != b'\x10\x81':  # echonet lite edata format 1
-            raise MomongaResponseNotExpected('The data format is not ECHONET Lite EDATA format 1')
-
-        if data[2:4] != tid.to_bytes(4, 'big')[-2:]:
-            raise MomongaResponseNotExpected('The transaction ID does not match.')
-
-        seoj = data[4:7]
-        if seoj != b'\x02\x88\x01':  # low-voltage smart electric energy meter class
-            raise MomongaResponseNotExpected('The source is not a smart meter.')
-
-        deoj = data[7:10]
-        if deoj != b'\x05\xFF\x01':  # controller class
-            raise MomongaResponseNotExpected('The destination is not a controller.')
-
-        if data[12] != epc:
-            raise MomongaResponseNotExpected('The property code does not match. EPC: %X' % epc)
+                                   epc_groups: list[list[int]],
+                                  ) -> list[bytes]:
+        mv = memoryview(data)
+        edts = []
+        cur = 11
+        for epcs in epc_groups:
+            opc = data[cur]
+            if opc != len(epcs):
+                raise MomongaResponseNotExpected('Unexpected packet format. OPC is expected %d but %d was set.' % (len(epcs), opc))
+            cur += 1
+
+            for epc in epcs:
+                if data[cur] != epc:
+                    raise MomongaResponseNotExpected('The property code does not match. EPC: %X' % epc)
+                pdc = data[cur + 1]
+                cur += 2
+                edts.append(mv[cur:cur+pdc].tobytes())  # the only copies made from the received data.
+                cur += pdc
 
         esv = data[10]
-        if 0x50 <= esv <= 0x5F:
+        if esv & 0xF0 == 0x50:  # 0x5X are the responses for "not possible"
             raise MomongaResponseNotPossible('The target smart meter could not respond. ESV: %X' % esv)
 
-        opc = data[11]
-        assert opc == 1, 'Unexpected packet format. OPC is expected 1 but %d was set.' % opc
-
-        pdc = data[13]
-        if pdc == 0:
-            edt = None
-        else:
-            edt = data[14:14+pdc]
-
-        return {'ehd': ehd, 'tid': tid, 'seoj': seoj, 'deoj': deoj,
-                'epc': epc, 'esv': esv, 'opc': opc, 'pdc': pdc, 'edt': edt}
+        return edts
 
     def __request(self,
                   epc: int,
                   edt: bytes = b'',
                  ) -> bytes:
-        self.transaction_id += 1
-        tx_payload = self.__build_request_payload(self.transaction_id, epc, edt)
-        while not self.session_manager.recv_q.empty():
-            self.session_manager.recv_q.get()  # drops stored data
-
-        for _ in range(self.xmit_retry):
-            self.session_manager.xmitter(tx_payload)
-            while True:
-                try:
-                    res = self.session_manager.recv_q.get(timeout=self.recv_timeout)
-                except queue.Empty:
-                    logger.warning('Timed out to obtain a response for "%X" request.' % (epc))
-                    break
-                if res.startswith('EVENT 21'):
-                    param = res.split()[-1]
-                    if param == '00':
-                        logger.info('Successfully transmitted a packet for "%X" request.' % (epc))
-                        continue
-                    elif param == '01':
-                        logger.info('Retransmitting the packet for "%X" request.' % (epc))
-                        time.sleep(self.internal_xmit_interval)
-                        break  # to rexmit
-                    elif param == '02':
-                        logger.info('Transmitting neighbor solicitation packets.' % (epc))
-                        continue
-                elif res.startswith('EVENT 02'):
-                    logger.info('Received a neighbor advertisement packet.' % (epc))
-                    continue
-                elif res.startswith('ERXUDP'):
-                    udp_pkt = SkEventRxUdp([res])
-                    if not (udp_pkt.src_port == udp_pkt.dst_port == 0x0E1A):
-                        continue
-                    elif udp_pkt.side != 0:
-                        continue
-                    elif udp_pkt.src_addr != self.session_manager.smart_meter_addr:
-                        continue
-
+        if edt:
+            esv = _ESV_SETC
+        else:
+            esv = _ESV_GET
+        return self.__request_properties(esv, [[(epc, edt)]])[0]
+
+    def __request_properties(self,
+                             esv: bytes,
+                             property_groups: list[list[tuple[int, bytes]]],
+                             xmit_retry: int | None = None,
+                             probe: bool = False,
+                            ) -> list[bytes] | None:
+        # with probe=True, a plain timeout returns None instead of retrying, as a meter may ignore an unsupported service.
+        # all the properties are carried by a single frame, so they share one round trip.
+        epc_groups = [[epc for epc, _ in properties] for properties in property_groups]
+        if xmit_retry is None:
+            xmit_retry = self.xmit_retry
+        with self.request_lock:
+            self.transaction_id = (self.transaction_id + 1) & 0xFFFF  # tid is a 16-bit field.
+            tx_payload = self.__build_request_payload(self.transaction_id, esv, property_groups)
+            tid = tx_payload[2:4]  # as encoded in the header
+            recv_q = self.session_manager.recv_q
+            drain_queue(recv_q)  # drops stored data
+
+            rexmit_cnt = 0  # only the retransmission events lengthen the backoff, not the timeouts.
+            for _ in range(xmit_retry):
+                self.session_manager.xmitter(tx_payload)
+                while True:
                     try:
-                        rx_payload = self.__extract_response_payload(udp_pkt.data, self.transaction_id, epc)
-                    except MomongaResponseNotExpected:
+                        res = recv_q.get_nowait()  # to handle a burst of lines without waiting on the condition.
+                    except queue.Empty:
+                        try:
+                            res = recv_q.get(timeout=self.recv_timeout)
+                        except queue.Empty:
+                            if probe is True:
+                                logger.info('No response for "%s" request.' % (_format_epcs(epc_groups)))
+                                return None
+                            logger.warning('Timed out to obtain a response for "%s" request.' % (_format_epcs(epc_groups)))
+                            break
+
+                    handler = self.__response_handlers.get(res.partition(' ')[0])
+                    if handler is None:
                         continue
 
-                    logger.info('Successfully received a packet for "%X" response.' % (epc))
+                    rx_payload = handler(res, tid, epc_groups)
+                    if rx_payload is None:
+                        continue
+                    elif rx_payload is _REXMIT:
+                        # to spread out the retransmissions on a congested pan.
+                        backoff = min(self.xmit_backoff_base * (2 ** rexmit_cnt), self.max_xmit_backoff)
+                        time.sleep(backoff + random.uniform(0, self.xmit_backoff_base))
+                        rexmit_cnt += 1
+                        break
                     return rx_payload
 
-        logger.error('Gave up to obtain a response for "%X" request. Close Momonga and open it again.' % (epc))
-        raise MomongaNeedToReopen('Gave up to obtain a response for "%X" request. Close Momonga and open it again.' % (epc))
+            logger.error('Gave up to obtain a response for "%s" request. Close Momonga and open it again.' % (_format_epcs(epc_groups)))
+            raise MomongaNeedToReopen('Gave up to obtain a response for "%s" request. Close Momonga and open it again.' % (_format_epcs(epc_groups)))
+
+    def __handle_event(self,
+                       res: str,
+                       tid: bytes,
+                       epc_groups: list[list[int]],
+                      ) -> object | None:
+        event_num = res[6:8]
+        if event_num == '21':
+            param = res.split()[-1]
+            if param == '00':
+                logger.info('Successfully transmitted a packet for "%s" request.' % (_format_epcs(epc_groups)))
+            elif param == '01':
+                logger.info('Retransmitting the packet for "%s" request.' % (_format_epcs(epc_groups)))
+                return _REXMIT
+            elif param == '02':
+                logger.info('Transmitting neighbor solicitation packets for "%s" request.' % (_format_epcs(epc_groups)))
+        elif event_num == '02':
+            logger.info('Received a neighbor advertisement packet for "%s" request.' % (_format_epcs(epc_groups)))
+        return None
+
+    def __handle_erxudp(self,
+                        res: str,
+                        tid: bytes,
+                        epc_groups: list[list[int]],
+                       ) -> list[bytes] | None:
+        # to drop the packets from other nodes or ports before decoding them.
+        res_list = res.split()
+        if not (res_list[3] == res_list[4] == '0E1A'):
+            return None
+        elif int(res_list[8], 16) != 0:
+            return None
+        elif res_list[1] != self.__smart_meter_addr:
+            return None
+
+        udp_pkt = SkEventRxUdp([res])
+        if not self.__is_expected_response(udp_pkt.data, tid):
+            return None
+
+        try:
+            rx_payload = self.__extract_response_payload(udp_pkt.data, epc_groups)
+        except (MomongaResponseNotExpected, IndexError) as e:
+            logger.warning('Dropped a malformed response for "%s" request: %s' % (_format_epcs(epc_groups), e))
+            return None
+
+        logger.info('Successfully received a packet for "%s" response.' % (_format_epcs(epc_groups)))
+        return rx_payload
 
     def __prepare_to_get_cumulative_energy(self) -> None:
+        if self.energy_scale is not None:
+            return
+
+        if self.energy_coefficient is None and self.energy_unit is None:
+            # to obtain both in one round trip. the coefficient is optional, so a meter can refuse it.
+            try:
+                res = self.request_to_get({0xD3, 0xE1})
+                self.energy_coefficient = res[0xD3]
+                self.energy_unit = res[0xE1]
+            except MomongaResponseNotPossible:
+                pass
+
         if self.energy_coefficient is None:
             try:
                 self.energy_coefficient = self.get_coefficient_for_cumulative_energy()
-                time.sleep(self.internal_xmit_interval)
             except MomongaResponseNotPossible:
                 self.energy_coefficient = 1
         if self.energy_unit is None:
             self.energy_unit = self.get_unit_for_cumulative_energy()
-            time.sleep(self.internal_xmit_interval)
 
-    def get_operation_status(self) -> bool | None:
-        res = self.__request(0x80)
-        status = int.from_bytes(res.get('edt'), 'big')
+        # the parsers multiply the raw values by this instead of looking up both every time.
+        self.energy_scale = self.energy_coefficient * self.energy_unit
+
+    def __parse_operation_status(self,
+                                 edt: bytes,
+                                ) -> bool | None:
+        status = edt[0]
         if status == 0x30:  # turned on
             status = True
         elif status == 0x31:  # turned off
@@ -196,16 +409,209 @@ class Momonga:
             status = None
         return status
 
-    def get_coefficient_for_cumulative_energy(self) -> int:
-        res = self.__request(0xD3)
-        coefficient = int.from_bytes(res.get('edt'), 'big')
+    def __parse_coefficient_for_cumulative_energy(self,
+                                                  edt: bytes,
+                                                 ) -> int:
+        (coefficient,) = _UINT32.unpack_from(edt)
         return coefficient
 
-    def get_number_of_effective_digits_for_cumulative_energy(self) -> int:
-        res = self.__request(0xD7)
-        digits = int.from_bytes(res.get('edt'), 'big')
+    def __parse_number_of_effective_digits_for_cumulative_energy(self,
+                                                                 edt: bytes,
+                                                                ) -> int:
+        digits = edt[0]
         return digits
 
+    def __parse_measured_cumulative_energy(self,
+                                           edt: bytes,
+                                          ) -> int | float:
+        (cumulative_energy,) = _UINT32.unpack_from(edt)
+        cumulative_energy *= self.energy_scale
+        return cumulative_energy
+
+    def __parse_unit_for_cumulative_energy(self,
+                                           edt: bytes,
+                                          ) -> int | float:
+        unit_index = edt[0]  # the unit is always a single byte.
+        if unit_index < len(_UNIT_TABLE):
+            return _UNIT_TABLE[unit_index]
+        return None
+
+    def __parse_historical_cumulative_energy_1(self,
+                                               edt: bytes,
+                                              ) -> list[dict[str: datetime.datetime,
+                                                             str: int | float | None]]:
+        scale = self.energy_scale
+        day, *energy_data_points = _HISTORICAL_ENERGY_1.unpack_from(edt)
+        timestamp = datetime.datetime.combine(datetime.date.today(), _MIDNIGHT) - datetime.timedelta(days=day)
+
+        energy_data_points = _scale_energy_data_points(energy_data_points, scale, edt.find(_NO_DATA, 2) != -1)
+        historical_cumulative_energy = [None] * 48
+        for i, cumulative_energy in enumerate(energy_data_points):
+            historical_cumulative_energy[i] = {'timestamp': timestamp + i * _HALF_HOUR,
+                                               'cumulative energy': cumulative_energy}
+        return historical_cumulative_energy
+
+    def __parse_day_for_historical_data_1(self,
+                                          edt: bytes,
+                                         ) -> int:
+        day = edt[0]
+        return day
+
+    def __parse_instantaneous_power(self,
+                                    edt: bytes,
+                                   ) -> float:
+        (power,) = _INT32.unpack_from(edt)
+        return power
+
+    def __parse_instantaneous_current(self,
+                                      edt: bytes,
+                                     ) -> dict[str: float, str: float]:
+        r_phase_current, t_phase_current = _INSTANTANEOUS_CURRENT.unpack_from(edt)
+        r_phase_current *= 0.1  # to Ampere
+        t_phase_current *= 0.1  # to Ampere
+        return {'r phase current': r_phase_current, 't phase current': t_phase_current}
+
+    def __parse_cumulative_energy_measured_at_fixed_time(self,
+                                                         edt: bytes,
+                                                        ) -> dict[str: datetime.datetime,
+                                                                  str: int | float]:
+        year, month, day, hour, minute, second, cumulative_energy = _FIXED_TIME_ENERGY.unpack_from(edt)
+        timestamp = datetime.datetime(year, month, day, hour, minute, second)
+        cumulative_energy *= self.energy_scale
+        return {'timestamp': timestamp, 'cumulative_energy': cumulative_energy}
+
+    def __parse_historical_cumulative_energy_2(self,
+                                               edt: bytes,
+                                              ) -> list[dict[str: datetime.datetime,
+                                                             str: dict[str: int | float | None,
+                                                                       str: int | float | None]]]:
+        scale = self.energy_scale
+        year, month, day, hour, minute, num_of_data_points = _TIME_FOR_HISTORICAL_DATA_2.unpack_from(edt)
+        energy_data_points = _scale_energy_data_points(_historical_energy_2_struct(num_of_data_points).unpack_from(edt, 7),
+                                                       scale, edt.find(_NO_DATA, 7) != -1)
+
+        timestamp = datetime.datetime(year, month, day, hour, minute)
+        historical_cumulative_energy = [None] * num_of_data_points
+        for i in range(num_of_data_points):
+            normal_direction_energy = energy_data_points[i * 2]
+            reverse_direction_energy = energy_data_points[i * 2 + 1]
+            historical_cumulative_energy[i] = {
+                'timestamp': timestamp - i * _HALF_HOUR,
+                'cumulative energy': {'normal direction': normal_direction_energy,
+                                      'reverse direction': reverse_direction_energy}}
+        return historical_cumulative_energy
+
+    def __parse_time_for_historical_data_2(self,
+                                           edt: bytes,
+                                          ) -> dict[str: datetime.datetime | None, str: int]:
+        year, month, day, hour, minute, num_of_data_points = _TIME_FOR_HISTORICAL_DATA_2.unpack_from(edt)
+        if year == 0xFFFF:
+            timestamp = None
+        else:
+            timestamp = datetime.datetime(year, month, day, hour, minute)
+
+        return {'timestamp': timestamp,
+                'number of data points': num_of_data_points}
+
+    def __set(self,
+              epc: int,
+              edt: bytes,
+             ) -> None:
+        with self.request_lock:  # the other threads wait until the batch is sent.
+            if self.__set_buffer is not None:
+                self.__set_buffer.append((epc, edt))
+            else:
+                self.__request(epc, edt)
+
+    @contextlib.contextmanager
+    def batch(self):
+        # to send the properties set inside the block in a single setc frame on exit.
+        with self.request_lock:
+            if self.__set_buffer is not None:  # nested
+                yield self
+                return
+
+            self.__set_buffer = []
+            try:
+                yield self
+                properties = self.__set_buffer
+            finally:
+                self.__set_buffer = None
+
+            if properties:
+                self.__request_properties(_ESV_SETC, [properties])
+
+    # the parsers for request_to_get() keyed by epc.
+    _EPC_PARSERS = {0x80: __parse_operation_status,
+                    0xD3: __parse_coefficient_for_cumulative_energy,
+                    0xD7: __parse_number_of_effective_digits_for_cumulative_energy,
+                    0xE0: __parse_measured_cumulative_energy,
+                    0xE1: __parse_unit_for_cumulative_energy,
+                    0xE2: __parse_historical_cumulative_energy_1,
+                    0xE3: __parse_measured_cumulative_energy,
+                    0xE4: __parse_historical_cumulative_energy_1,
+                    0xE5: __parse_day_for_historical_data_1,
+                    0xE7: __parse_instantaneous_power,
+                    0xE8: __parse_instantaneous_current,
+                    0xEA: __parse_cumulative_energy_measured_at_fixed_time,
+                    0xEB: __parse_cumulative_energy_measured_at_fixed_time,
+                    0xEC: __parse_historical_cumulative_energy_2,
+                    0xED: __parse_time_for_historical_data_2}
+    # epc is a single byte, so the parsers are looked up by index on the hot path.
+    _EPC_PARSER_TABLE = tuple(map(_EPC_PARSERS.get, range(0x100)))
+
+    def request_to_get(self,
+                       epcs: set[int],
+                       *,
+                       out: dict[int, object] | None = None,
+                      ) -> dict[int, object]:
+        epcs = frozenset(epcs)
+        for epc in epcs:
+            if not 0 <= epc <= 0xFF or self._EPC_PARSER_TABLE[epc] is None:
+                raise MomongaKeyError('No parser found for EPC: %X' % epc)
+
+        # a polling loop can pass the same dict every time not to allocate a new one.
+        if out is None:
+            parsed_results = {}
+        else:
+            parsed_results = out
+            parsed_results.clear()
+
+        # to serve the stable properties from the cache and send only the rest.
+        for epc in epcs:
+            value = _lookup_cached_response(self.response_cache, epc)
+            if value is not _NOT_CACHED:
+                parsed_results[epc] = value
+        if len(parsed_results) == len(epcs):
+            return parsed_results
+
+        properties = _build_get_properties(epcs.difference(parsed_results))
+        if not _CUMULATIVE_ENERGY_EPCS.isdisjoint(epc for epc, _ in properties):
+            self.__prepare_to_get_cumulative_energy()
+
+        edts = self.__request_properties(_ESV_GET, [properties])
+
+        parser_table = self._EPC_PARSER_TABLE
+        for (epc, _), edt in zip(properties, edts):
+            value = parser_table[epc](self, edt)
+            parsed_results[epc] = value
+            _store_cached_response(self.response_cache, epc, value)
+        return parsed_results
+
+    def get_operation_status(self) -> bool | None:
+        edt = self.__request(0x80)
+        return self.__parse_operation_status(edt)
+
+    @_ttl_cache(0xD3)
+    def get_coefficient_for_cumulative_energy(self) -> int:
+        edt = self.__request(0xD3)
+        return self.__parse_coefficient_for_cumulative_energy(edt)
+
+    @_ttl_cache(0xD7)
+    def get_number_of_effective_digits_for_cumulative_energy(self) -> int:
+        edt = self.__request(0xD7)
+        return self.__parse_number_of_effective_digits_for_cumulative_energy(edt)
+
     def get_measured_cumulative_energy(self,
                                        reverse: bool = False,
                                       ) -> int | float:
@@ -216,25 +622,13 @@ class Momonga:
         else:
             epc = 0xE3
 
-        res = self.__request(epc)
-        cumulative_energy = int.from_bytes(res.get('edt'), 'big')
-        cumulative_energy *= self.energy_coefficient
-        cumulative_energy *= self.energy_unit
-        return cumulative_energy
+        edt = self.__request(epc)
+        return self.__parse_measured_cumulative_energy(edt)
 
+    @_ttl_cache(0xE1)
     def get_unit_for_cumulative_energy(self) -> int | float:
-        res = self.__request(0xE1)
-        unit_index = int.from_bytes(res.get('edt'), 'big')
-        unit_map = {0x00: 1,
-                    0x01: 0.1,
-                    0x02: 0.01,
-                    0x03: 0.001,
-                    0x04: 0.0001,
-                    0x0A: 10,
-                    0x0B: 100,
-                    0x0C: 1000,
-                    0x0D: 10000}
-        return unit_map.get(unit_index)
+        edt = self.__request(0xE1)
+        return self.__parse_unit_for_cumulative_energy(edt)
 
     def get_historical_cumulative_energy_1(self,
                                            day: int = 0,
@@ -243,56 +637,38 @@ class Momonga:
                                                           str: dict[str: int | float | None,
                                                                     str: int | float | None]]]:
         self.__prepare_to_get_cumulative_energy()
-        self.set_day_for_historical_data_1(day)
 
         if reverse is False:
             epc = 0xE2
         else:
             epc = 0xE4
 
-        res = self.__request(epc)
-        edt = res.get('edt')
-        day = int.from_bytes(edt[0:2], 'big')
-        timestamp = datetime.datetime.combine(datetime.date.today(), datetime.datetime.min.time())
-        timestamp -= datetime.timedelta(days=day)
-
-        energy_data_points = edt[2:]
-        historical_cumulative_energy = []
-        for i in range(48):
-            j = i * 4
-            cumulative_energy = int.from_bytes(energy_data_points[j:j+4], 'big')
-            if cumulative_energy == 0xFFFFFFFE:
-                cumulative_energy = None
-            else:
-                cumulative_energy *= self.energy_coefficient
-                cumulative_energy *= self.energy_unit
-            historical_cumulative_energy.append({'timestamp': timestamp, 'cumulative energy': cumulative_energy})
-            timestamp += datetime.timedelta(minutes=30)
-        return historical_cumulative_energy
+        with self.request_lock:  # not to let another thread change the day in between.
+            self.__request(0xE5, day.to_bytes(1, 'big'))
+            edt = self.__request(epc)
+        return self.__parse_historical_cumulative_energy_1(edt)
 
     def set_day_for_historical_data_1(self,
                                       day: int = 0,
                                      ) -> None:
-        self.__request(0xE5, day.to_bytes(1, 'big'))
+        self.__set(0xE5, self.__build_edt_to_set_day_for_historical_data_1(day))
+
+    def __build_edt_to_set_day_for_historical_data_1(self,
+                                                     day: int,
+                                                    ) -> bytes:
+        return day.to_bytes(1, 'big')
 
     def get_day_for_historical_data_1(self) -> int:
-        res = self.__request(0xE5)
-        day = int.from_bytes(res.get('edt'), 'big')
-        return day
+        edt = self.__request(0xE5)
+        return self.__parse_day_for_historical_data_1(edt)
 
     def get_instantaneous_power(self) -> float:
-        res = self.__request(0xE7)
-        power = int.from_bytes(res.get('edt'), 'big', signed=True)
-        return power
+        edt = self.__request(0xE7)
+        return self.__parse_instantaneous_power(edt)
 
     def get_instantaneous_current(self) -> dict[str: float, str: float]:
-        res = self.__request(0xE8)
-        edt = res.get('edt')
-        r_phase_current = int.from_bytes(edt[0:2], 'big', signed=True)
-        t_phase_current = int.from_bytes(edt[2:4], 'big', signed=True)
-        r_phase_current *= 0.1  # to Ampere
-        t_phase_current *= 0.1  # to Ampere
-        return {'r phase current': r_phase_current, 't phase current': t_phase_current}
+        edt = self.__request(0xE8)
+        return self.__parse_instantaneous_current(edt)
 
     def get_cumulative_energy_measured_at_fixed_time(self,
                                                      reverse: bool = False,
@@ -305,14 +681,8 @@ class Momonga:
         else:
             epc = 0xEB
 
-        res = self.__request(epc)
-        edt = res.get('edt')
-        timestamp = datetime.datetime(int.from_bytes(edt[0:2], 'big'),
-                                      edt[2], edt[3], edt[4], edt[5], edt[6])
-        cumulative_energy = int.from_bytes(edt[7:], 'big')
-        cumulative_energy *= self.energy_coefficient
-        cumulative_energy *= self.energy_unit
-        return {'timestamp': timestamp, 'cumulative_energy': cumulative_energy}
+        edt = self.__request(epc)
+        return self.__parse_cumulative_energy_measured_at_fixed_time(edt)
 
     def get_historical_cumulative_energy_2(self,
                                            timestamp: datetime.datetime = None,
@@ -324,66 +694,83 @@ class Momonga:
             timestamp = datetime.datetime.now()
 
         self.__prepare_to_get_cumulative_energy()
-        self.set_time_for_historical_data_2(timestamp, num_of_data_points)
-
-        res = self.__request(0xEC)
-        edt = res.get('edt')
-        year = int.from_bytes(edt[0:2], 'big')
-        num_of_data_points = edt[6]
-        energy_data_points = edt[7:]
-
-        timestamp = datetime.datetime(year, edt[2], edt[3], edt[4], edt[5])
-        historical_cumulative_energy = []
-        for i in range(num_of_data_points):
-            j = i * 8
-            normal_direction_energy = int.from_bytes(energy_data_points[j:j+4], 'big')
-            if normal_direction_energy == 0xFFFFFFFE:
-                normal_direction_energy = None
-            else:
-                normal_direction_energy *= self.energy_coefficient
-                normal_direction_energy *= self.energy_unit
-
-            reverse_direction_energy = int.from_bytes(energy_data_points[j+4:j+8], 'big')
-            if reverse_direction_energy == 0xFFFFFFFE:
-                reverse_direction_energy = None
-            else:
-                reverse_direction_energy *= self.energy_coefficient
-                reverse_direction_energy *= self.energy_unit
-
-            historical_cumulative_energy.append(
-                {'timestamp': timestamp,
-                 'cumulative energy': {'normal direction': normal_direction_energy,
-                                       'reverse direction': reverse_direction_energy}})
-            timestamp -= datetime.timedelta(minutes=30)
-        return historical_cumulative_energy
+        with self.request_lock:  # not to let another thread change the time in between.
+            edt = None
+            if self.setget_supported is not False:
+                edt = self.__setget_historical_cumulative_energy_2(timestamp, num_of_data_points)
+            if edt is None:
+                self.__request(0xED, self.__build_time_for_historical_data_2(timestamp, num_of_data_points))
+                edt = self.__request(0xEC)
+        return self.__parse_historical_cumulative_energy_2(edt)
+
+    def __setget_historical_cumulative_energy_2(self,
+                                                timestamp: datetime.datetime,
+                                                num_of_data_points: int,
+                                               ) -> bytes | None:
+        # to set the time and get the history in a single round trip if the meter supports setget.
+        property_groups = [[(0xED, self.__build_time_for_historical_data_2(timestamp, num_of_data_points))],
+                           [(0xEC, b'')]]
+        if self.setget_supported is None:
+            # an explicit sna or a silence without retransmission means no support; the other failures propagate.
+            try:
+                edts = self.__request_properties(_ESV_SETGET, property_groups, probe=True)
+            except MomongaResponseNotPossible:
+                edts = None
+            if edts is None:
+                logger.info('The smart meter does not support SetGet. Falling back to SetC and Get.')
+                self.setget_supported = False
+                return None
+            self.setget_supported = True
+        else:
+            edts = self.__request_properties(_ESV_SETGET, property_groups)
+        return edts[1]
 
     def set_time_for_historical_data_2(self,
                                        timestamp: datetime.datetime,
                                        num_of_data_points: int = 12,
                                       ) -> None:
-        year = timestamp.year.to_bytes(2, 'big')
-        month = timestamp.month.to_bytes(1, 'big')
-        day = timestamp.day.to_bytes(1, 'big')
-        hour = timestamp.hour.to_bytes(1, 'big')
+        self.__set(0xED, self.__build_time_for_historical_data_2(timestamp, num_of_data_points))
 
+    def __build_time_for_historical_data_2(self,
+                                           timestamp: datetime.datetime,
+                                           num_of_data_points: int,
+                                          ) -> bytes:
         if 0 <= timestamp.minute < 30:
             minute = 0
         else:
             minute = 30
 
-        minute = minute.to_bytes(1, 'big')
-        num_of_data_points = num_of_data_points.to_bytes(1, 'big')
-        self.__request(0xED, year + month + day + hour + minute + num_of_data_points)
+        return _TIME_FOR_HISTORICAL_DATA_2.pack(timestamp.year, timestamp.month, timestamp.day,
+                                                timestamp.hour, minute, num_of_data_points)
 
     def get_time_for_historical_data_2(self) -> dict[str: datetime.datetime | None, str: int]:
-        res = self.__request(0xED)
-        edt = res.get('edt')
-        year = int.from_bytes(edt[0:2], 'big')
-        if year == 0xFFFF:
-            timestamp = None
-        else:
-            timestamp = datetime.datetime(year, edt[2], edt[3], edt[4], edt[5])
-
-        num_of_data_points = edt[6]
-        return {'timestamp': timestamp,
-                'number of data points': num_of_data_points}
+        edt = self.__request(0xED)
+        return self.__parse_time_for_historical_data_2(edt)
+
+    def __build_edt_to_set_time_for_historical_data_2(self,
+                                                      time_for_historical_data_2: dict[str: datetime.datetime,
+                                                                                       str: int],
+                                                     ) -> bytes:
+        return self.__build_time_for_historical_data_2(time_for_historical_data_2['timestamp'],
+                                                       time_for_historical_data_2.get('number of data points', 12))
+
+    # the keyword arguments of request_to_set() with their epcs and edt builders.
+    _SET_BUILDERS = (('day_for_historical_data_1', 0xE5, __build_edt_to_set_day_for_historical_data_1),
+                     ('time_for_historical_data_2', 0xED, __build_edt_to_set_time_for_historical_data_2))
+
+    def request_to_set(self,
+                       day_for_historical_data_1: int | None = None,
+                       time_for_historical_data_2: dict[str: datetime.datetime, str: int] | None = None,
+                      ) -> None:
+        values = {'day_for_historical_data_1': day_for_historical_data_1,
+                  'time_for_historical_data_2': time_for_historical_data_2}
+        properties = [(epc, build(self, values[name]))
+                      for name, epc, build in self._SET_BUILDERS if values[name] is not None]
+        if not properties:
+            return  # nothing to set
+
+        with self.request_lock:
+            if self.__set_buffer is not None:
+                self.__set_buffer.extend(properties)
+            else:
+                self.__request_properties(_ESV_SETC, [properties])
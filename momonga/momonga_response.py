@@ -1,15 +1,33 @@
+import functools
+
 from .momonga_exception import MomongaKeyError
 
 
 class MomongaSkResponseBase:
+    # the fields are decoded on first access, so a caller pays only for what it reads.
     def __init__(self, res):
         self.raw_response = res
-        self.decode()
 
-    def decode(self):
-        pass
+    @functools.cached_property
+    def _by_prefix(self):
+        # to index each line by its leading tokens (e.g. 'EVER', 'EVENT 21') and by its label (e.g. 'Pan ID:').
+        by_prefix = {}
+        for elm in self.raw_response:  # the later lines win, the same as the reversed scan below.
+            tokens = elm.split(maxsplit=2)
+            if tokens:
+                by_prefix[tokens[0]] = elm
+                by_prefix[' '.join(tokens[:2])] = elm
+            label, sep, _ = elm.partition(':')
+            if sep:
+                by_prefix[label.strip() + sep] = elm
+        return by_prefix
 
     def extract(self, key):
+        elm = self._by_prefix.get(key)
+        if elm is not None:
+            return elm
+
+        # to fall back on a substring match for keys that are not at the head of a line.
         for elm in reversed(self.raw_response):
             if key in elm:
                 return elm
@@ -17,64 +35,150 @@ class MomongaSkResponseBase:
 
 
 class SkVerResponse(MomongaSkResponseBase):
-    def decode(self):
-        res_list = self.extract('EVER').split()
-        self.stack_ver = res_list[1]
+    @functools.cached_property
+    def stack_ver(self):
+        return self.extract('EVER').split()[1]
 
 
 class SkAppVerResponse(MomongaSkResponseBase):
-    def decode(self):
-        res_list = self.extract('EAPPVER').split()
-        self.app_ver = res_list[1]
+    @functools.cached_property
+    def app_ver(self):
+        return self.extract('EAPPVER').split()[1]
 
 
 class SkInfoResponse(MomongaSkResponseBase):
-    def decode(self):
-        res_list = self.extract('EINFO').split()
-        self.ip6_addr = res_list[1]
-        self.mac_addr = bytes.fromhex(res_list[2])
-        self.channel = int(res_list[3], 16)
-        self.pan_id = bytes.fromhex(res_list[4])
-        self.side = int(res_list[5], 16)
+    @functools.cached_property
+    def res_list(self):
+        return self.extract('EINFO').split()
+
+    @functools.cached_property
+    def ip6_addr(self):
+        return self.res_list[1]
+
+    @functools.cached_property
+    def mac_addr(self):
+        return bytes.fromhex(self.res_list[2])
+
+    @functools.cached_property
+    def channel(self):
+        return int(self.res_list[3], 16)
+
+    @functools.cached_property
+    def pan_id(self):
+        return bytes.fromhex(self.res_list[4])
+
+    @functools.cached_property
+    def side(self):
+        return int(self.res_list[5], 16)
 
 
 class SkScanResponse(MomongaSkResponseBase):
-    def decode(self):
-        self.channel = int(self.extract('Channel:').split(':')[-1], 16)
-        self.channel_page = int(self.extract('Channel Page:').split(':')[-1], 16)
-        self.pan_id = bytes.fromhex(self.extract('Pan ID:').split(':')[-1])
-        self.mac_addr = bytes.fromhex(self.extract('Addr:').split(':')[-1])
-        self.lqi = int(self.extract('LQI:').split(':')[-1], 16)
-        self.rssi = 0.275 * self.lqi - 104.27
-        self.side = int(self.extract('Side:').split(':')[-1], 16)
-        self.pair_id = bytes.fromhex(self.extract('PairID:').split(':')[-1])
+    @functools.cached_property
+    def channel(self):
+        return int(self.extract('Channel:').split(':')[-1], 16)
+
+    @functools.cached_property
+    def channel_page(self):
+        return int(self.extract('Channel Page:').split(':')[-1], 16)
+
+    @functools.cached_property
+    def pan_id(self):
+        return bytes.fromhex(self.extract('Pan ID:').split(':')[-1])
+
+    @functools.cached_property
+    def mac_addr(self):
+        return bytes.fromhex(self.extract('Addr:').split(':')[-1])
+
+    @functools.cached_property
+    def lqi(self):
+        return int(self.extract('LQI:').split(':')[-1], 16)
+
+    @functools.cached_property
+    def rssi(self):
+        return 0.275 * self.lqi - 104.27
+
+    @functools.cached_property
+    def side(self):
+        return int(self.extract('Side:').split(':')[-1], 16)
+
+    @functools.cached_property
+    def pair_id(self):
+        return bytes.fromhex(self.extract('PairID:').split(':')[-1])
 
 
 class SkLl64Response(MomongaSkResponseBase):
-    def decode(self):
-        self.ip6_addr = self.extract('FE80:')
+    @functools.cached_property
+    def ip6_addr(self):
+        return self.extract('FE80:')
 
 
 class SkSendToResponse(MomongaSkResponseBase):
-    def decode(self):
-        self.res_list = self.extract('EVENT 21').split()
-        self.event_num = int(self.res_list[1], 16)
-        self.src_addr = self.res_list[2]
-        self.side = int(self.res_list[3], 16)
-        self.param = int(self.res_list[4], 16)
+    @functools.cached_property
+    def res_list(self):
+        return self.extract('EVENT 21').split()
+
+    @functools.cached_property
+    def event_num(self):
+        return int(self.res_list[1], 16)
+
+    @functools.cached_property
+    def src_addr(self):
+        return self.res_list[2]
+
+    @functools.cached_property
+    def side(self):
+        return int(self.res_list[3], 16)
+
+    @functools.cached_property
+    def param(self):
+        return int(self.res_list[4], 16)
 
 
 class SkEventRxUdp(MomongaSkResponseBase):
-    def decode(self):
-        self.res_list = self.extract('ERXUDP').split()
-        self.src_addr = self.res_list[1]
-        self.des_addr = self.res_list[2]
-        self.src_port = int(self.res_list[3], 16)
-        self.dst_port = int(self.res_list[4], 16)
-        self.src_mac = bytes.fromhex(self.res_list[5])
-        self.lqi = int(self.res_list[6], 16)
-        self.rssi = 0.275 * self.lqi - 104.27
-        self.sec = int(self.res_list[7], 16)
-        self.side = int(self.res_list[8], 16)
-        self.data_len = int(self.res_list[9], 16)
-        self.data = bytes.fromhex(self.res_list[10])
+    @functools.cached_property
+    def res_list(self):
+        return self.extract('ERXUDP').split()
+
+    @functools.cached_property
+    def src_addr(self):
+        return self.res_list[1]
+
+    @functools.cached_property
+    def des_addr(self):
+        return self.res_list[2]
+
+    @functools.cached_property
+    def src_port(self):
+        return int(self.res_list[3], 16)
+
+    @functools.cached_property
+    def dst_port(self):
+        return int(self.res_list[4], 16)
+
+    @functools.cached_property
+    def src_mac(self):
+        return bytes.fromhex(self.res_list[5])
+
+    @functools.cached_property
+    def lqi(self):
+        return int(self.res_list[6], 16)
+
+    @functools.cached_property
+    def rssi(self):
+        return 0.275 * self.lqi - 104.27
+
+    @functools.cached_property
+    def sec(self):
+        return int(self.res_list[7], 16)
+
+    @functools.cached_property
+    def side(self):
+        return int(self.res_list[8], 16)
+
+    @functools.cached_property
+    def data_len(self):
+        return int(self.res_list[9], 16)
+
+    @functools.cached_property
+    def data(self):
+        return bytes.fromhex(self.res_list[10])
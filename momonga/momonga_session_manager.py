@@ -21,6 +21,24 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 
+def drain_queue(q: queue.Queue | queue.SimpleQueue) -> None:
+    if isinstance(q, queue.SimpleQueue):
+        # a simple queue has no mutex to hold, so to pop the items until it runs dry.
+        try:
+            while True:
+                q.get_nowait()
+        except queue.Empty:
+            pass
+        return
+
+    # to drop all the stored items in one lock acquisition.
+    with q.mutex:
+        q.queue.clear()
+        q.unfinished_tasks = 0
+        q.all_tasks_done.notify_all()
+        q.not_full.notify_all()
+
+
 class MomongaSessionManager:
     def __init__(self,
                  rbid: str,
@@ -49,12 +67,29 @@ class MomongaSessionManager:
         self.receiver_th = None
         self.receiver_exception = None
         self.xmit_restriction_cnt = 0
-        self.xmit_lock = threading.Lock()
+        # to guard "xmit_restriction_cnt" and "receiver_exception", and to wake the xmitter up when they change.
+        self.xmit_cond = threading.Condition()
         self.rejoin_lock = threading.Lock()
 
+        # pkt_sbsc_q must stay unbounded: the receiver thread rejoins the pan by itself,
+        # and the publisher would deadlock on a full queue before delivering the response to skjoin().
         self.pkt_sbsc_q = queue.Queue()
-        self.recv_q = queue.Queue()
-        self.xmit_q = queue.Queue()
+        self.recv_q = queue.SimpleQueue()  # the receiver thread to Momonga; neither join() nor maxsize is needed.
+        self.xmit_q = queue.SimpleQueue()
+
+        # to dispatch the received lines by their heads: 'EVENT NN' or 'ERXUDP'.
+        self.__receiver_handlers = {
+            'EVENT 29': self.__on_session_expired,
+            'EVENT 24': self.__on_rejoin_failure,
+            'EVENT 25': self.__on_rejoin_success,
+            'EVENT 32': self.__on_rate_limit_exceeded,
+            'EVENT 33': self.__on_rate_limit_released,
+            'EVENT 27': self.__on_session_closed,
+            'EVENT 28': self.__on_no_session_to_close,
+            'EVENT 21': self.__on_xmit_event,
+            'EVENT 02': self.__on_xmit_event,
+            'ERXUDP': self.__on_rx_udp,
+        }
 
     # def __enter__(self) -> Self:
     def __enter__(self):
@@ -113,12 +148,9 @@ class MomongaSessionManager:
                 logger.error('Gave up to establish a PANA session. Check the Route-B ID and password. Then try again.')
                 raise MomongaSkJoinFailure('Gave up to establish a PANA session. Check the Route-B ID and password. Then try again.')
 
-            while not self.pkt_sbsc_q.empty():
-                self.pkt_sbsc_q.get()
-            while not self.recv_q.empty():
-                self.recv_q.get()
-            while not self.xmit_q.empty():
-                self.xmit_q.get()
+            drain_queue(self.pkt_sbsc_q)
+            drain_queue(self.recv_q)
+            drain_queue(self.xmit_q)
 
             self.receiver_th = threading.Thread(target=self.receiver, daemon=True)
 
@@ -129,7 +161,7 @@ class MomongaSessionManager:
             logger.info('A Momonga session is open.')
             return self
         except Exception as e:
-            logger.error('Could not open a Momonga session. %s: %s' % (type(e).__name__, e))
+            logger.error('Could not open a Momonga session. %s: %s', type(e).__name__, e)
             self.close()
             raise e
 
@@ -145,7 +177,7 @@ class MomongaSessionManager:
                 logger.info('Terminating the PANA session...')
                 self.skw.skterm()
             except Exception as e:
-                logger.warning('Failed to terminate the PANA session. %s: %s' % (type(e).__name__, e))
+                logger.warning('Failed to terminate the PANA session. %s: %s', type(e).__name__, e)
             finally:
                 self.rejoin_lock.release()
         else:
@@ -162,7 +194,6 @@ class MomongaSessionManager:
 
         self.unrestrict_to_xmit(force=True)
 
-        assert self.xmit_lock.locked() is False, '"xmit_lock" is unexpectedly locked.'
         assert self.rejoin_lock.locked() is False, '"rejoin_lock" is unexpectedly locked.'
 
         self.skw.close()
@@ -170,131 +201,163 @@ class MomongaSessionManager:
 
     def receiver(self) -> None:
         logger.debug('A packet receiver has been started.')
+        # to bind the per-packet lookups once, out of the loop.
+        get_pkt = self.pkt_sbsc_q.get
+        get_handler = self.__receiver_handlers.get
         try:
             while True:
-                res = self.pkt_sbsc_q.get()
+                res = get_pkt()
                 if res == '__CLOSE__':
                     break
 
-                if not (res.startswith('EVENT') or res.startswith('ERXUDP')):
-                    # droping the command responses.
+                key = res[:8] if res.startswith('EVENT') else res.partition(' ')[0]
+                handler = get_handler(key)
+                if handler is None:
+                    # droping the command responses and the uninteresting events.
                     continue
-
-                if res.startswith('EVENT 29'):
-                    logger.debug('The PANA session lifetime has been expired.')
-                    self.restrict_to_xmit()
-                elif res.startswith('EVENT 24'):
-                    logger.warning('Could not rejoin the PAN.')
-                    self.rejoin_lock.acquire()
-                    if self.session_established is True:
-                        self.session_established = False
-                        try:
-                            self.skw.skjoin(self.smart_meter_addr)
-                        except MomongaSkJoinFailure as e:
-                            logger.error('%s Close Momonga and open it again.' % (e))
-                            raise MomongaNeedToReopen('%s Close Momonga and open it again.' % (e))
-                        finally:
-                            self.rejoin_lock.release()
-                    else:
-                        self.rejoin_lock.release()
-                elif res.startswith('EVENT 25'):
-                    logger.debug('Successfully rejoined the PAN.')
-                    self.session_established = True
-                    self.unrestrict_to_xmit()
-                elif res.startswith('EVENT 32'):
-                    logger.warning('The transmission rate limit has been exceeded.')
-                    self.restrict_to_xmit()
-                elif res.startswith('EVENT 33'):
-                    logger.debug('The transmission rate limit has been released.')
-                    self.unrestrict_to_xmit()
-                elif res.startswith('EVENT 27'):
-                    self.restrict_to_xmit()
-                    logger.debug('The PANA session has been closed successfully.')
-                elif res.startswith('EVENT 28'):  # there was no session to close.
-                    self.restrict_to_xmit()
-                    logger.warning('There was no PANA session to close.')
-                elif res.startswith("EVENT 21") or res.startswith("EVENT 02"):
-                    if self.is_restricted_to_xmit() is False:
-                        self.recv_q.put(res)
-                elif res.startswith("ERXUDP"):
-                    self.recv_q.put(res)
+                handler(res)
         except Exception as e:
-            logger.error('An exception was raised from the receiver thread. %s: %s' % (type(e).__name__, e))
-            self.receiver_exception = e
+            logger.error('An exception was raised from the receiver thread. %s: %s', type(e).__name__, e)
+            with self.xmit_cond:
+                self.receiver_exception = e
+                self.xmit_cond.notify_all()
 
         logger.debug('The packet receiver has been stopped.')
 
+    def __on_session_expired(self,
+                             res: str,
+                            ) -> None:
+        logger.debug('The PANA session lifetime has been expired.')
+        self.restrict_to_xmit()
+
+    def __on_rejoin_failure(self,
+                            res: str,
+                           ) -> None:
+        logger.warning('Could not rejoin the PAN.')
+        self.rejoin_lock.acquire()
+        if self.session_established is True:
+            self.session_established = False
+            try:
+                self.skw.skjoin(self.smart_meter_addr)
+            except MomongaSkJoinFailure as e:
+                logger.error('%s Close Momonga and open it again.', e)
+                raise MomongaNeedToReopen('%s Close Momonga and open it again.' % (e))
+            finally:
+                self.rejoin_lock.release()
+        else:
+            self.rejoin_lock.release()
+
+    def __on_rejoin_success(self,
+                            res: str,
+                           ) -> None:
+        logger.debug('Successfully rejoined the PAN.')
+        self.session_established = True
+        self.unrestrict_to_xmit()
+
+    def __on_rate_limit_exceeded(self,
+                                 res: str,
+                                ) -> None:
+        logger.warning('The transmission rate limit has been exceeded.')
+        self.restrict_to_xmit()
+
+    def __on_rate_limit_released(self,
+                                 res: str,
+                                ) -> None:
+        logger.debug('The transmission rate limit has been released.')
+        self.unrestrict_to_xmit()
+
+    def __on_session_closed(self,
+                            res: str,
+                           ) -> None:
+        self.restrict_to_xmit()
+        logger.debug('The PANA session has been closed successfully.')
+
+    def __on_no_session_to_close(self,
+                                 res: str,
+                                ) -> None:
+        self.restrict_to_xmit()
+        logger.warning('There was no PANA session to close.')
+
+    def __on_xmit_event(self,
+                        res: str,
+                       ) -> None:
+        if self.is_restricted_to_xmit() is False:
+            self.recv_q.put(res)
+
+    def __on_rx_udp(self,
+                    res: str,
+                   ) -> None:
+        self.recv_q.put(res)
+
     def xmitter(self,
                 data: bytes,
                ) -> None:
         retry_to_xmit = 3
-        retry_to_acquire_xmit_lock = 60
+        retry_to_wait_for_xmit = 60
         xmitted = False
         for _ in range(retry_to_xmit):
-            logger.debug('Trying to acquire "xmit_lock".')
-            for r in range(retry_to_acquire_xmit_lock):
-                unlocked = self.xmit_lock.acquire(timeout=60)
-                if unlocked is False:
-                    logger.warning('Could not acquire "xmit_lock". (%d/%d)' % (r + 1, retry_to_acquire_xmit_lock))
+            logger.debug('Waiting for data transmission to be unrestricted.')
+            with self.xmit_cond:
+                for r in range(retry_to_wait_for_xmit):
+                    # to be woken up as soon as the restriction is lifted or the receiver thread dies.
+                    unrestricted = self.xmit_cond.wait_for(lambda: self.xmit_restriction_cnt == 0 or self.receiver_exception is not None,
+                                                           timeout=60)
                     if self.receiver_exception is not None:
-                        logger.error('Got an exception from the receiver thread. %s: %s' % (type(self.receiver_exception).__name__, self.receiver_exception))
+                        logger.error('Got an exception from the receiver thread. %s: %s', type(self.receiver_exception).__name__, self.receiver_exception)
                         raise MomongaNeedToReopen('Got an exception from the receiver thread. %s: %s' % (type(self.receiver_exception).__name__, self.receiver_exception))
-                else:
-                    break
+                    elif unrestricted is False:
+                        logger.warning('Data transmission is still restricted. (%d/%d)', r + 1, retry_to_wait_for_xmit)
+                    else:
+                        break
 
-            if unlocked is False:
-                logger.error('Transmission rights could not be acquired. Close Momonga and open it again.')
-                raise MomongaNeedToReopen('Transmission rights could not be acquired. Close Momonga and open it again.')
-            else:
-                logger.debug('Acquired "xmit_lock".')
+                if unrestricted is False:
+                    logger.error('Transmission rights could not be acquired. Close Momonga and open it again.')
+                    raise MomongaNeedToReopen('Transmission rights could not be acquired. Close Momonga and open it again.')
+                else:
+                    logger.debug('Data transmission is allowed.')
 
-            assert self.session_established is not False, 'Tried to transmit a packet, but no PANA session was established.'
+                assert self.session_established is not False, 'Tried to transmit a packet, but no PANA session was established.'
 
-            try:
-                self.skw.sksendto(self.smart_meter_addr, data)
-                xmitted = True
-                break
-            except MomongaSkCommandExecutionFailure as e:
-                logger.warning('Failed to transmit a packet: %s' % (e))
-            except Exception as e:
-                logger.warning('An error occurred to transmit a packet. %s: %s' % (type(e).__name__, e))
-            finally:
-                self.xmit_lock.release()
+                # to keep holding "xmit_cond" while sending so that a restriction waits for the packet in flight.
+                try:
+                    self.skw.sksendto(self.smart_meter_addr, data)
+                    xmitted = True
+                    break
+                except MomongaSkCommandExecutionFailure as e:
+                    logger.warning('Failed to transmit a packet: %s', e)
+                except Exception as e:
+                    logger.warning('An error occurred to transmit a packet. %s: %s', type(e).__name__, e)
             time.sleep(3)
         if xmitted is False:
             logger.error('Could not transmit a packet. Close Momonga and open it again.')
             raise MomongaNeedToReopen('Could not transmit a packet. Close Momonga and open it again.')
 
     def restrict_to_xmit(self) -> None:
-        self.xmit_restriction_cnt += 1
-        logger.debug('The counter for the restriction was incremented: %d' % (self.xmit_restriction_cnt))
+        with self.xmit_cond:  # to wait for the packet in flight, if any.
+            self.xmit_restriction_cnt += 1
+            logger.debug('The counter for the restriction was incremented: %d', self.xmit_restriction_cnt)
 
-        assert self.xmit_restriction_cnt <= 2, 'The critical section counter for data transmission is inconsistent: Too big than expected.'
+            assert self.xmit_restriction_cnt <= 2, 'The critical section counter for data transmission is inconsistent: Too big than expected.'
 
-        if self.xmit_restriction_cnt == 1:
-            logger.debug('Trying to restrict data transmission.')
-            self.xmit_lock.acquire()
-            logger.debug('Data transmission is being restricted.')
+            if self.xmit_restriction_cnt == 1:
+                logger.debug('Data transmission is being restricted.')
 
     def unrestrict_to_xmit(self,
                            force=False,
                           ) -> None:
-        if force is True:
-            self.xmit_restriction_cnt = 0
-            logger.debug('The counter for the restriction was forcibly set to zero.')
-        else:
-            self.xmit_restriction_cnt -= 1
-            logger.debug('The counter for the restriction was decremented: %d' % (self.xmit_restriction_cnt))
-
-        assert self.xmit_restriction_cnt >= 0, 'The critical section counter for data transmit is inconsistent: Too small than expected.'
+        with self.xmit_cond:
+            if force is True:
+                self.xmit_restriction_cnt = 0
+                logger.debug('The counter for the restriction was forcibly set to zero.')
+            else:
+                self.xmit_restriction_cnt -= 1
+                logger.debug('The counter for the restriction was decremented: %d', self.xmit_restriction_cnt)
 
-        if self.xmit_restriction_cnt == 0:
-            try:
-                self.xmit_lock.release()
-            except RuntimeError:
-                pass  # xmit_lock is likely already unlocked.
+            assert self.xmit_restriction_cnt >= 0, 'The critical section counter for data transmit is inconsistent: Too small than expected.'
 
-            logger.debug('Data transmission is being unrestricted.')
+            if self.xmit_restriction_cnt == 0:
+                self.xmit_cond.notify_all()
+                logger.debug('Data transmission is being unrestricted.')
 
     def is_restricted_to_xmit(self) -> bool:
         if self.xmit_restriction_cnt == 0:
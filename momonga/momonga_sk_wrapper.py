@@ -1,3 +1,4 @@
+import functools
 import logging
 import threading
 import queue
@@ -26,6 +27,27 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# the exceptions and messages for the error codes in 'FAIL ERnn' lines.
+_SK_FAIL_ERRORS = {1: (MomongaSkCommandUnknownError, 'Unknown error code %(error_code)s: %(command)s'),
+                   2: (MomongaSkCommandUnknownError, 'Unknown error code %(error_code)s: %(command)s'),
+                   3: (MomongaSkCommandUnknownError, 'Unknown error code %(error_code)s: %(command)s'),
+                   4: (MomongaSkCommandUnsupported, 'Unsupported command: %(command)s'),
+                   5: (MomongaSkCommandInvalidArgument, 'Invalid argument: %(command)s'),
+                   6: (MomongaSkCommandInvalidSyntax, 'Invalid syntax: %(command)s'),
+                   7: (MomongaSkCommandUnknownError, 'Unknown error code %(error_code)s: %(command)s'),
+                   8: (MomongaSkCommandUnknownError, 'Unknown error code %(error_code)s: %(command)s'),
+                   9: (MomongaSkCommandSerialInputError, 'Serial input error: %(command)s'),
+                   10: (MomongaSkCommandFailedToExecute,
+                        'The specified command was accepted but failed to execute: %(command)s'),
+                  }
+
+
+@functools.lru_cache(maxsize=16)
+def _encode_bare_command(command: str) -> bytes:
+    # only the commands without arguments (e.g. SKVER, SKINFO, SKRESET and SKTERM) are cached,
+    # not to keep the lines carrying the route-b id or the password in memory.
+    return (command + '\r\n').encode()
+
 
 class MomongaSkWrapper:
     def __init__(self,
@@ -38,7 +60,9 @@ class MomongaSkWrapper:
         # the following value will be set a pyserial object.
         self.ser = None
         self.publisher_th = None
-        self.subscribers = {'cmd_exec_q': queue.Queue()}
+        self.publisher_th_breaker = threading.Event()  # set when you want to stop the publisher.
+        self.rx_buf = b''
+        self.subscribers = {'cmd_exec_q': queue.SimpleQueue()}
 
     #def __enter__(self) -> Self:
     def __enter__(self):
@@ -66,36 +90,39 @@ class MomongaSkWrapper:
             while not q.empty():
                 q.get()
 
-        self.publisher_th_breaker = False  # set True when you want to stop the publisher.
+        self.ser.timeout = None  # to let the publisher wait for the lines without polling.
+        self.rx_buf = b''  # the incomplete line left by the last read.
+        self.publisher_th_breaker.clear()
         self.publisher_th = threading.Thread(target=self.received_packet_publisher, daemon=True)
         self.publisher_th.start()
 
     def close(self) -> None:
         if self.publisher_th is not None:
-            self.publisher_th_breaker = True
-            self.publisher_th.join()
+            self.publisher_th_breaker.set()
+            while self.publisher_th.is_alive():
+                self.ser.cancel_read()  # to wake the publisher up from the blocking readline.
+                self.publisher_th.join(timeout=1)
             self.publisher_th = None
         if self.ser is not None and not self.ser.closed:
+            self.ser.flush()  # to let the last command drain to the wire before closing.
             self.ser.close()
 
     def __clear_buf(self) -> None:  # do not call this after open().
         self.ser.write(b'\r\n')
-        self.ser.flush()
         timeout = self.ser.timeout
         self.ser.timeout = 2  # will wait the specified seconds.
-        while self.ser.read():
-            # this loop clears garbage data if it exists.
+        while self.ser.read(max(1, self.ser.in_waiting)):
+            # this loop clears garbage data if it exists, taking all the buffered bytes at once.
             pass
         # to undo the timeout.
         self.ser.timeout = timeout
 
     def __exec_ropt(self) -> int:  # do not call this after open().
         self.ser.write(b'ROPT\r')
-        self.ser.flush()
         res = b''
         ok = b'OK '
         while True:
-            res += self.ser.read()
+            res += self.ser.read(max(1, self.ser.in_waiting))  # to take the rest of the reply in one call.
             if ok in res and res.endswith(b'\r'):
                 break
         return int(res[res.index(ok) + len(ok):-1].decode())
@@ -110,36 +137,35 @@ class MomongaSkWrapper:
             raise MomongaError('WOPT command dose not support the given option: %02d' % opt)
 
         self.ser.write(('WOPT %02d\r' % opt).encode())
-        self.ser.flush()
         res = b''
         while True:
-            res += self.ser.read()
+            res += self.ser.read(max(1, self.ser.in_waiting))  # to take the rest of the reply in one call.
             if b'OK\r' in res:
                 break
         return
 
-    def __readline(self,
-                   timeout: int | None = None,
-                   ) -> str:
-        org_timeout = self.ser.timeout
-        self.ser.timeout = timeout
-        data_bytes = self.ser.readline()
-        self.ser.timeout = org_timeout
-        if data_bytes != b'':
-            logger.debug('<<< %s' % data_bytes)
-        line = data_bytes.decode().split('\r\n')[0]
-        return line
+    def __readlines(self) -> list[str]:
+        # to take all the buffered bytes in one read; pyserial's readline() reads a byte per call.
+        data_bytes = self.ser.read(max(1, self.ser.in_waiting))  # blocks until a byte arrives or the read is cancelled.
+        *data_lines, self.rx_buf = (self.rx_buf + data_bytes).split(b'\n')
+        lines = []
+        for data_line in data_lines:
+            logger.debug('<<< %s', data_line + b'\n')
+            lines.append(data_line.decode().removesuffix('\r'))
+        return lines
 
     def received_packet_publisher(self) -> None:
         logger.debug('A received packet publisher has been started.')
-        while True:
-            if self.publisher_th_breaker is True:
-                break
-            line = self.__readline(timeout=1)
-            if line == '':
-                continue
-            for q in self.subscribers.values():
-                q.put(line)  # will dispatch the line to each subscriber
+        cmd_exec_q = self.subscribers['cmd_exec_q']
+        while not self.publisher_th_breaker.is_set():
+            for line in self.__readlines():
+                if line == '':
+                    continue
+                is_rx_udp = line.startswith('ERXUDP')
+                for q in self.subscribers.values():
+                    if is_rx_udp and q is cmd_exec_q:
+                        continue  # no command waits for a udp packet.
+                    q.put(line)  # will dispatch the line to each subscriber
         logger.debug('The received packet publisher has been stopped.')
 
     def __writeline(self,
@@ -147,12 +173,13 @@ class MomongaSkWrapper:
                     payload: bytes | None = None,
                     ) -> None:
         if payload is not None:
-            data_bytes = (line + ' ').encode() + payload
+            data_bytes = b' '.join((line.encode(), payload))  # to build the frame at its final size.
+        elif ' ' not in line:
+            data_bytes = _encode_bare_command(line)
         else:
             data_bytes = (line + '\r\n').encode()
         self.ser.write(data_bytes)
-        logger.debug('>>> %s' % data_bytes)
-        self.ser.flush()
+        logger.debug('>>> %s', data_bytes)
 
     def exec_command(self,
                      command: list[str],
@@ -163,7 +190,9 @@ class MomongaSkWrapper:
         command = ' '.join(command)
 
         if type(wait_until) is str:
-            wait_until = [wait_until]
+            wait_until = (wait_until,)
+        else:
+            wait_until = tuple(wait_until)  # for str.startswith() to try all the prefixes at once.
 
         subscriber_q = self.subscribers['cmd_exec_q']
         while not subscriber_q.empty():
@@ -172,38 +201,25 @@ class MomongaSkWrapper:
         self.__writeline(command, payload)
 
         res = []
+        # to bind the per-line lookups once, out of the loop.
+        get_line = subscriber_q.get
+        append_line = res.append
         while True:
-            r = subscriber_q.get(timeout=timeout)
-            if r.startswith('ERXUDP'):
-                continue
-
+            try:
+                r = get_line(timeout=timeout)
+            except queue.Empty:
+                raise MomongaTimeoutError('The command timed out: %s' % (command))
             if r == '':
                 raise MomongaTimeoutError('The command timed out: %s' % (command))
-            elif r[:4] == 'FAIL':
+            elif r.startswith('FAIL'):
                 error_code = int(r[7:10])
-                if 1 <= error_code <= 3:
-                    raise MomongaSkCommandUnknownError('Unknown error code %s: %s' % (error_code, command))
-                elif error_code == 4:
-                    raise MomongaSkCommandUnsupported('Unsupported command: %s' % (command))
-                elif error_code == 5:
-                    raise MomongaSkCommandInvalidArgument('Invalid argument: %s' % (command))
-                elif error_code == 6:
-                    raise MomongaSkCommandInvalidSyntax('Invalid syntax: %s' % (command))
-                elif 7 <= error_code <= 8:
-                    raise MomongaSkCommandUnknownError('Unknown error code %s: %s' % (error_code, command))
-                elif error_code == 9:
-                    raise MomongaSkCommandSerialInputError('Serial input error: %s' % (command))
-                elif error_code == 10:
-                    raise MomongaSkCommandFailedToExecute(
-                        'The specified command was accepted but failed to execute: %s' % (command))
+                error = _SK_FAIL_ERRORS.get(error_code)
+                if error is not None:
+                    exception, message = error
+                    raise exception(message % {'error_code': error_code, 'command': command})
             else:
-                res.append(r)
-                matched = False
-                for w in wait_until:
-                    if r.startswith(w):
-                        matched = True
-                        break
-                if matched is True:
+                append_line(r)
+                if r.startswith(wait_until):
                     break
         return res
 
@@ -247,7 +263,7 @@ class MomongaSkWrapper:
                ) -> SkScanResponse:
         duration = 6
         for _ in range(retry):
-            logger.debug('Trying to scan a PAN... Duration: %d' % duration)
+            logger.debug('Trying to scan a PAN... Duration: %d', duration)
             res = self.exec_command(['SKSCAN', '2', 'FFFFFFFF', str(duration), '0'], 'EVENT 22')
             # estimated execution time: 0.0096s*(2^(DURATION=6)+1)*28 = 17.5s
             # estimated execution time: 0.0096s*(2^(DURATION=7)+1)*28 = 34.7s
@@ -269,7 +285,12 @@ class MomongaSkWrapper:
                ) -> None:
         for _ in range(retry):
             logger.debug('Trying to establish a PANA session...')
-            res = self.exec_command(['SKJOIN', ip6_addr], ['EVENT 24', 'EVENT 25'])
+            try:
+                # to give up on the try if the module goes silent instead of reporting EVENT 24.
+                res = self.exec_command(['SKJOIN', ip6_addr], ['EVENT 24', 'EVENT 25'], timeout=60)
+            except MomongaTimeoutError:
+                logger.warning('Timed out to establish a PANA session.')
+                continue
             # extimated execution time: 2s + 4s + 8s + 8s + 8s + 8s + 8s = 38s ~ 40s
             if res[-1].startswith('EVENT 25'):
                 logger.debug('A PANA Session has been established.')
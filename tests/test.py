@@ -1,28 +1,38 @@
 
+import datetime
+import json
 import logging
 import os
+import random
 import sys
 import time
 import momonga
 
-from pprint import pprint
+from logging.handlers import MemoryHandler
+from pprint import pformat
 
 
 log_fmt = logging.Formatter('%(asctime)s | %(levelname)s | %(name)s - %(message)s')
 log_hnd = logging.StreamHandler()
 log_hnd.setFormatter(log_fmt)
-momonga.logger.addHandler(log_hnd)
-momonga.logger.setLevel(logging.DEBUG)
-momonga.session_manager_logger.addHandler(log_hnd)
-momonga.session_manager_logger.setLevel(logging.DEBUG)
-momonga.sk_wrapper_logger.addHandler(log_hnd)
-momonga.sk_wrapper_logger.setLevel(logging.DEBUG)
+# to write the records out in bulk rather than one write per record. warnings and errors are written at once.
+mem_hnd = MemoryHandler(capacity=1024, flushLevel=logging.WARNING, target=log_hnd)
+# set MOMONGA_LOG=DEBUG to trace the serial communication.
+log_level = getattr(logging, os.environ.get('MOMONGA_LOG', 'INFO').upper(), logging.INFO)
+momonga.logger.addHandler(mem_hnd)
+momonga.logger.setLevel(log_level)
+momonga.session_manager_logger.addHandler(mem_hnd)
+momonga.session_manager_logger.setLevel(log_level)
+momonga.sk_wrapper_logger.addHandler(mem_hnd)
+momonga.sk_wrapper_logger.setLevel(log_level)
 
 # set the following environment values before run.
 rbid = os.environ.get('MOMONGA_ROUTEB_ID')
 pwd = os.environ.get('MOMONGA_ROUTEB_PASSWORD')
 dev = os.environ.get('MOMONGA_DEV_PATH')
 baudrate = os.environ.get('MOMONGA_DEV_BAUDRATE')
+max_attempts = int(os.environ.get('MOMONGA_MAX_ATTEMPTS', '10'))  # to give up on a misconfigured setup.
+poll_interval = float(os.environ.get('MOMONGA_POLL_INTERVAL', '1.0'))  # the minimum seconds between requests.
 
 exit_code = 1
 
@@ -41,90 +51,168 @@ if baudrate is None:
 else:
     baudrate = int(baudrate)
 
-while True:
+
+def paced(last_t: float) -> float:
+    # to wait only for the rest of the interval since the last request completed.
+    dt = time.monotonic() - last_t
+    if dt < poll_interval:
+        time.sleep(poll_interval - dt)
+    return time.monotonic()
+
+
+def print_section(title: str, body: str) -> None:
+    # to write a whole section at once rather than line by line.
+    sys.stdout.write('---- %s ----\n%s\n----\n' % (title, body))
+
+
+def format_history(res: list) -> str:
+    # the historical data have dozens of points, so to put them on one line unless --pretty is given.
+    if '--pretty' in sys.argv:
+        return pformat(res)
+    return json.dumps(res, default=lambda o: o.isoformat() if isinstance(o, datetime.datetime) else str(o))
+
+
+def print_sections(res: dict, sections: tuple) -> None:
+    for epc, title, unit in sections:
+        if epc == 0x80:
+            body = {True: 'turned on', False: 'turned off'}.get(res[epc], 'unknown')
+        elif unit is not None:
+            body = '%s %s' % (res[epc], unit)
+        else:
+            body = pformat(res[epc])
+        print_section(title, body)
+
+
+# the epc, the title and the unit of each property that is stable for a session.
+# a meter may refuse the coefficient (0xD3), then momonga assumes 1.
+STATIC_SECTIONS = ((0xD3, 'coefficient for cumulative energy', None),
+                   (0xD7, 'number of effective digits for cumulative energy', None),
+                   (0xE1, 'unit for cumulative energy [kWh]', 'kWh'),
+                  )
+
+# the epc, the title and the unit of each property read at once.
+SECTIONS = ((0x80, 'operation status of smart meter', None),
+            (0xE0, 'measured cumulative energy (normal direction) [kWh]', 'kWh'),
+            (0xE7, 'instantaneous power [W]', 'W'),
+            (0xE8, 'instantaneous current [A]', None),
+            (0xEA, 'cumulative energy measured at fixed time (normal direction) [kWh]', None),
+           )
+
+# the reverse direction properties, which a meter without generation measurement refuses.
+REVERSE_SECTIONS = ((0xE3, 'measured cumulative energy (reverse direction) [kWh]', 'kWh'),
+                    (0xEB, 'cumulative energy measured at fixed time (reverse direction) [kWh]', None),
+                   )
+
+reverse_supported = None  # will be set by read_reverse_properties().
+
+
+def read_static_properties(mo: momonga.Momonga) -> bool:
+    # to read the static properties once per session. momonga also caches them until close().
+    try:
+        static = mo.request_to_get({epc for epc, _, _ in STATIC_SECTIONS})
+        print_sections(static, STATIC_SECTIONS)
+    except momonga.MomongaResponseNotPossible:
+        # the coefficient is optional, so to read the others without it.
+        sections = tuple(section for section in STATIC_SECTIONS if section[0] != 0xD3)
+        static = mo.request_to_get({epc for epc, _, _ in sections})
+        print_section('coefficient for cumulative energy', '(unsupported on this meter) — 1 assumed')
+        print_sections(static, sections)
+    return True
+
+
+def read_properties(mo: momonga.Momonga) -> bool:
+    # to read the properties that need no setting beforehand in a single round trip.
+    res = mo.request_to_get({epc for epc, _, _ in SECTIONS})
+    print_sections(res, SECTIONS)
+    return True
+
+
+def read_reverse_properties(mo: momonga.Momonga) -> bool:
+    # to probe both with one round trip, then one by one on a refusal since a meter may lack 0xEB only.
+    # whether the meter measures the reverse direction at all depends on 0xE3 alone.
+    global reverse_supported
+    try:
+        res = mo.request_to_get({epc for epc, _, _ in REVERSE_SECTIONS})
+        print_sections(res, REVERSE_SECTIONS)
+        reverse_supported = True
+    except momonga.MomongaResponseNotPossible:
+        reverse_supported = False
+        for section in REVERSE_SECTIONS:
+            epc, title, _ = section
+            try:
+                res = mo.request_to_get({epc})
+            except momonga.MomongaResponseNotPossible:
+                print_section(title, '(unsupported on this meter)')
+                continue
+            print_sections(res, (section,))
+            if epc == 0xE3:
+                reverse_supported = True
+    return True
+
+
+def read_historical_cumulative_energy_1(mo: momonga.Momonga) -> bool:
+    res = mo.get_historical_cumulative_energy_1()
+    print_section('historical cumulative energy 1 (normal direction) [kWh]', format_history(res))
+    return True
+
+
+def read_historical_cumulative_energy_1_reverse(mo: momonga.Momonga) -> bool:
+    if reverse_supported is not True:
+        print_section('historical cumulative energy 1 (reverse direction) [kWh]', '(unsupported on this meter)')
+        return False  # nothing was requested.
+    res = mo.get_historical_cumulative_energy_1(reverse=True)
+    print_section('historical cumulative energy 1 (reverse direction) [kWh]', format_history(res))
+    return True
+
+
+def read_historical_cumulative_energy_2(mo: momonga.Momonga) -> bool:
+    res = mo.get_historical_cumulative_energy_2()
+    print_section('historical_cumulative_energy_2 [kWh]', format_history(res))
+    return True
+
+
+# each step returns whether it made a request, to be paced before the next one.
+STEPS = (read_static_properties,
+         read_properties,
+         read_reverse_properties,
+         read_historical_cumulative_energy_1,
+         read_historical_cumulative_energy_1_reverse,
+         read_historical_cumulative_energy_2,
+        )
+
+failures = 0  # the number of consecutive failures to open a session.
+next_step = 0  # to resume from the interrupted step after reopening, not from the first one.
+for attempt in range(max_attempts):
     try:
         with momonga.Momonga(rbid, pwd, dev, baudrate) as mo:
-            print('---- operation status of smart meter ----')
-            res = mo.get_operation_status()
-            if res is True:
-                print('turned on')
-            elif res is False:
-                print('turned off')
-            else:
-                print('unknown')
-            print('----')
-            time.sleep(5)
-
-            print('---- number of effective digits for cumulative energy ----')
-            res = mo.get_number_of_effective_digits_for_cumulative_energy()
-            print(res)
-            print('----')
-            time.sleep(5)
-
-            print('---- measured cumulative energy (normal direction) [kWh] ----')
-            res = mo.get_measured_cumulative_energy()
-            print(res, 'kWh')
-            print('----')
-            time.sleep(5)
-
-            print('---- measured cumulative energy (reverse direction) [kWh] ----')
-            res = mo.get_measured_cumulative_energy(reverse=True)
-            print(res, 'kWh')
-            print('----')
-            time.sleep(5)
-
-            print('---- historical cumulative energy 1 (normal direction) [kWh] ----')
-            res = mo.get_historical_cumulative_energy_1()
-            pprint(res)
-            print('----')
-            time.sleep(5)
-
-            print('---- historical cumulative energy 1 (reverse direction) [kWh] ----')
-            res = mo.get_historical_cumulative_energy_1(reverse=True)
-            pprint(res)
-            print('----')
-            time.sleep(5)
-
-            print('---- instantaneous power [W] ----')
-            res = mo.get_instantaneous_power()
-            print(res, 'W')
-            print('----')
-            time.sleep(5)
-
-            print('---- instantaneous current [A] ----')
-            res = mo.get_instantaneous_current()
-            pprint(res)
-            print('----')
-            time.sleep(5)
-
-            print('---- cumulative energy measured at fixed time (normal direction) [kWh] ----')
-            res = mo.get_cumulative_energy_measured_at_fixed_time()
-            pprint(res)
-            print('----')
-            time.sleep(5)
-
-            print('---- cumulative energy measured at fixed time (reverse direction) [kWh] ----')
-            res = mo.get_cumulative_energy_measured_at_fixed_time(reverse=True)
-            pprint(res)
-            print('----')
-            time.sleep(5)
-
-            print('---- historical_cumulative_energy_2 [kWh] ----')
-            res = mo.get_historical_cumulative_energy_2()
-            pprint(res)
-            print('----')
-            time.sleep(5)
+            failures = 0
+            last_t = time.monotonic()
+            while next_step < len(STEPS):
+                requested = STEPS[next_step](mo)
+                next_step += 1
+                if requested is True:
+                    last_t = paced(last_t)
 
             exit_code = 0
             break
     except (momonga.MomongaSkScanFailure,
             momonga.MomongaSkJoinFailure,
             momonga.MomongaNeedToReopen,
-           ):
-        time.sleep(60)
+           ) as e:
+        if attempt + 1 == max_attempts:
+            print('%s: %s Gave up after %d attempts.' % (type(e).__name__, e, max_attempts), file=sys.stderr)
+            exit_code = 2
+            break
+        # to retry soon after a transient failure and back off up to 2 minutes on a persistent one.
+        delay = min(120, 2 ** failures) + random.uniform(0, 1)
+        print('%s: %s Retrying in %.1f seconds. (%d/%d)' % (type(e).__name__, e, delay, attempt + 1, max_attempts),
+              file=sys.stderr)
+        time.sleep(delay)
+        failures += 1
         continue
     except Exception as e:
         print('%s: %s' % (type(e).__name__, str(e)), file=sys.stderr)
         break
 
+mem_hnd.flush()
 exit(exit_code)